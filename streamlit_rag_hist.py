@@ -1,250 +1,785 @@
-"""
-Streamlit app: Gemini File Search + simple chat UI (updated)
-
-Changes in this version:
-- Removed metadata handling entirely (no custom_metadata sent to the API).
-- Implemented an ephemeral per-browser-session "conversation memory" that accumulates previous Q&A pairs in the prompt.
-  - The prompt format sent to Gemini contains two sections: PREVIOUSLY_ASKED and CURRENTLY_ASKING.
-  - After each question/answer exchange the Q&A pair is appended to the session memory.
-  - Memory is stored in `st.session_state` and will reset when the user closes the browser or the session expires.
-
-How to run:
-1. pip install streamlit google-genai python-docx PyPDF2 pandas
-2. streamlit run streamlit_gemini_file_search.py
-
-"""
-
-import time
-from pathlib import Path
-from typing import List, Dict
-
-import streamlit as st
-
-# You may need to install the package that contains `genai`.
-# pip install google-genai
-try:
-    from google import genai
-    from google.genai import types
-except Exception:
-    genai = None
-    types = None
-
-
-def filename_display_name(filename: str) -> str:
-    """Return the filename without extension to use for display_name"""
-    return Path(filename).stem
-
-
-def build_prompt(history: List[Dict[str, str]], current_question: str) -> str:
-    """Build the prompt with PREVIOUSLY_ASKED and CURRENTLY_ASKING sections.
-    history is a list of dicts with keys: 'question' and 'answer'.
-    """
-    prev_lines: List[str] = []
-    for item in history:
-        q = item.get("question", "").strip()
-        a = item.get("answer", "").strip()
-        if q or a:
-            prev_lines.append(f"Q: {q}\nA: {a}")
-
-    previously = "\n".join(prev_lines)
-    prompt = (
-        "There are 2 sections in this. Previously asked and currently asking. While answering you need to check the previously asked then answer the query that is present in the currently asking section.\n"
-        "PREVIOUSLY_ASKED:\n\n"
-        f"{previously}\n\n"
-        "CURRENTLY_ASKING:\n"
-        f"{current_question}"
-    )
-    return prompt
-
-
-# Streamlit UI
-st.set_page_config(page_title="Gemini File Search — Streamlit", layout="centered")
-st.title("Welcome To Gemini RAG")
-
-st.markdown(
-    """
-This demo lets you upload one document (no metadata), create a File Search store,
-then ask questions. The app keeps an ephemeral per-browser-session memory of prior Q&A
-that is placed into the prompt for subsequent queries. Memory resets when the browser session ends.
-"""
-)
-
-# API key input (in the middle)
-col1, col2, col3 = st.columns([1, 2, 1])
-with col2:
-    api_key = st.text_input("Gemini API Key", type="password", help="Paste your Gemini (Google GenAI) API key here")
-
-# File uploader (max 1)
-uploaded_file = st.file_uploader(
-    "Upload ONE document (pdf, csv, json, docx, txt)",
-    type=["pdf", "csv", "json", "docx", "txt"],
-    accept_multiple_files=False,
-)
-
-# Upload button
-start_upload = st.button("Upload Data And Start Chatting", key="upload_btn")
-
-# Session state initialization
-if 'client' not in st.session_state:
-    st.session_state['client'] = None
-if 'file_search_store_name' not in st.session_state:
-    st.session_state['file_search_store_name'] = None
-if 'uploaded_filename' not in st.session_state:
-    st.session_state['uploaded_filename'] = None
-if 'file_search_ready' not in st.session_state:
-    st.session_state['file_search_ready'] = False
-# ephemeral conversation memory: list of {'question':..., 'answer':...}
-if 'conversation_history' not in st.session_state:
-    st.session_state['conversation_history'] = []
-
-
-# When upload button is clicked
-if start_upload:
-    if not api_key:
-        st.error("Please enter your Gemini API key before uploading.")
-    elif not uploaded_file:
-        st.error("Please upload a file (max 1) to continue.")
-    else:
-        # initialize client
-        if genai is None or types is None:
-            st.error("The required GenAI library is not installed or failed to import.\nRun: pip install google-genai")
-        else:
-            try:
-                client = genai.Client(api_key=api_key)
-                st.session_state['client'] = client
-            except Exception as e:
-                st.error(f"Failed to create GenAI client: {e}")
-                client = None
-
-            if client:
-                try:
-                    # Create file search store with display name set to filename stem
-                    st.info("Creating File Search store...")
-                    file_search_store = client.file_search_stores.create(
-                        config={"display_name": filename_display_name(uploaded_file.name)}
-                    )
-                    st.session_state['file_search_store_name'] = file_search_store.name
-                    st.session_state['uploaded_filename'] = uploaded_file.name
-
-                    # Save uploaded file to a temp path to pass to API if needed
-                    tmp_dir = Path("./.tmp_uploaded_files")
-                    tmp_dir.mkdir(exist_ok=True)
-                    tmp_path = tmp_dir / uploaded_file.name
-                    with open(tmp_path, "wb") as f:
-                        f.write(uploaded_file.getbuffer())
-
-                    st.info(f"Uploading and importing file into File Search store: {uploaded_file.name}")
-                    # NOTE: No custom_metadata is passed per user's request
-                    operation = client.file_search_stores.upload_to_file_search_store(
-                        file=str(tmp_path),
-                        file_search_store_name=file_search_store.name,
-                        config={
-                            "display_name": filename_display_name(uploaded_file.name),
-                        },
-                    )
-
-                    # Wait for operation to complete (basic poll)
-                    with st.spinner('Importing file to Gemini File Search (this may take some time)...'):
-                        poll_seconds = 2
-                        max_wait = 300  # seconds
-                        waited = 0
-                        while not getattr(operation, 'done', False) and waited < max_wait:
-                            time.sleep(poll_seconds)
-                            waited += poll_seconds
-                            try:
-                                operation = client.operations.get(operation)
-                            except Exception:
-                                # some SDKs surface operation differently; break to avoid infinite loop
-                                break
-
-                    if getattr(operation, 'done', False):
-                        st.success("File successfully uploaded and imported. You can now ask questions about it below.")
-                        st.session_state['file_search_ready'] = True
-                        # reset any prior conversation (fresh upload)
-                        st.session_state['conversation_history'] = []
-                    else:
-                        st.warning(
-                            "Upload operation did not report completion within the app's wait period. The file may still be importing in the background. You can try to ask questions; the store may become available shortly."
-                        )
-                        st.session_state['file_search_ready'] = True
-
-                except Exception as e:
-                    st.exception(e)
-
-
-# Chat UI — only enabled after a successful upload
-st.markdown("---")
-if st.session_state.get('file_search_ready'):
-    st.subheader("Chat with your document")
-    question = st.text_area("Ask a question about the uploaded file:")
-    if st.button("Get answer"):
-        if not api_key or not st.session_state.get('client'):
-            st.error("Missing client or API key. Re-enter your API key and press 'Upload Data And Start Chatting' again.")
-        elif not st.session_state.get('file_search_store_name'):
-            st.error("File Search store is not available. Upload again.")
-        elif not question or not question.strip():
-            st.error("Please enter a question.")
-        else:
-            client = st.session_state['client']
-            file_search_store_name = st.session_state['file_search_store_name']
-            try:
-                # Build prompt including previous history
-                prompt = build_prompt(st.session_state['conversation_history'], question)
-
-                # Call generate_content (example from user's snippet)
-                response = client.models.generate_content(
-                    model="gemini-2.5-flash-preview-09-2025",
-                    contents=prompt,
-                    config=types.GenerateContentConfig(
-                        tools=[
-                            types.Tool(
-                                file_search=types.FileSearch(
-                                    file_search_store_names=[file_search_store_name]
-                                )
-                            )
-                        ]
-                    ),
-                )
-
-                # Extract answer text; SDKs differ so try a couple of attributes
-                answer_text = getattr(response, 'text', None)
-                if answer_text is None:
-                    # try other likely places
-                    answer_text = getattr(response, 'output', None)
-                if answer_text is None:
-                    # fallback: stringify full response
-                    st.write(response)
-                else:
-                    st.success("Answer:")
-                    st.write(answer_text)
-
-                    # Append Q&A to session conversation history so next prompt includes it
-                    st.session_state['conversation_history'].append({'question': question, 'answer': answer_text})
-
-            except Exception as e:
-                st.exception(e)
-else:
-    st.info("Upload a file and click 'Upload Data And Start Chatting' to enable the chat interface.")
-
-
-# Small housekeeping: provide instructions and optional debug info
-st.markdown("---")
-with st.expander("How this works (technical)"):
-    st.write(
-        """
-        1. Enter your Gemini API key in the top box.
-        2. Upload a single file (pdf/csv/json/docx/txt). No metadata is requested.
-        3. Click Upload Data And Start Chatting — the app will create a File Search store and import the file.
-        4. After import, use the chat box to ask questions. The app builds a prompt containing two sections: PREVIOUSLY_ASKED (which contains prior Q&A pairs from your current browser session) and CURRENTLY_ASKING (your new question). The combined prompt is sent to Gemini with the File Search tool enabled.
-        5. The conversation memory lives only in your browser session (Streamlit session_state) and resets when you close the browser tab or the session expires.
-        """
-    )
-
-if st.checkbox("Show debug session state"):
-    st.json({
-        'file_search_store_name': st.session_state.get('file_search_store_name'),
-        'uploaded_filename': st.session_state.get('uploaded_filename'),
-        'conversation_history': st.session_state.get('conversation_history')
-    })
-
-# End of app
+"""
+Streamlit app: Gemini File Search + simple chat UI (updated)
+
+Changes in this version:
+- Removed metadata handling entirely (no custom_metadata sent to the API).
+- Implemented an ephemeral per-browser-session "conversation memory" that accumulates previous Q&A pairs in the prompt.
+  - The prompt format sent to Gemini contains three sections: PRIOR_SUMMARY, RECENT_TURNS and CURRENTLY_ASKING.
+  - Only the last few turns are kept verbatim; older turns are compressed into a rolling summary so the prompt stays bounded.
+  - After each question/answer exchange the Q&A pair is appended to the session memory.
+  - Memory is stored in `st.session_state` and will reset when the user closes the browser or the session expires.
+
+How to run:
+1. pip install streamlit google-genai python-docx PyPDF2 pandas
+2. streamlit run streamlit_gemini_file_search.py
+
+"""
+
+import collections
+import hashlib
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Deque, List, Dict
+
+import streamlit as st
+
+# You may need to install the package that contains `genai`.
+# pip install google-genai
+try:
+    from google import genai
+    from google.genai import types
+except Exception:
+    genai = None
+    types = None
+
+
+def filename_display_name(filename: str) -> str:
+    """Return the filename without extension to use for display_name"""
+    return Path(filename).stem
+
+
+@st.cache_resource
+def get_client(api_key_hash: str, _api_key: str):
+    """Return a genai.Client for this API key, cached across reruns.
+
+    Cached on the key's SHA-256 hash (the leading-underscore arg is excluded
+    from Streamlit's cache key) so the secret is never repr'd in the cache,
+    and repeated uploads reuse the same HTTP connection pool instead of
+    redoing TLS + auth on every click.
+    """
+    return genai.Client(api_key=_api_key)
+
+
+def client_for_key(api_key: str):
+    """Convenience wrapper: hash the key and fetch the cached client."""
+    return get_client(hashlib.sha256(api_key.encode()).hexdigest(), api_key)
+
+
+# Local mapping of uploaded-content hash -> File Search store name, so
+# re-uploading an identical document skips store creation and import.
+STORE_CACHE_PATH = Path.home() / ".gemini_rag_store_cache.json"
+
+
+# One chunk of this size is the peak memory cost of hashing or spooling an
+# upload, regardless of file size.
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+
+def hash_uploaded_file(uploaded_file) -> str:
+    """Return a BLAKE2b hex digest of the upload, hashing in fixed-size chunks.
+
+    This runs as a separate pre-pass rather than folded into the disk write:
+    the dedup/rerun short-circuits need the digest before we know whether a
+    disk write (or any API call) will happen at all. Both passes are chunked,
+    so peak memory stays at one UPLOAD_CHUNK_SIZE buffer either way.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    uploaded_file.seek(0)
+    while True:
+        buf = uploaded_file.read(UPLOAD_CHUNK_SIZE)
+        if not buf:
+            break
+        h.update(buf)
+    uploaded_file.seek(0)
+    return h.hexdigest()
+
+
+def write_uploaded_file(uploaded_file, dest_path) -> None:
+    """Stream the upload to dest_path in fixed-size chunks."""
+    uploaded_file.seek(0)
+    with open(dest_path, "wb") as f:
+        while True:
+            buf = uploaded_file.read(UPLOAD_CHUNK_SIZE)
+            if not buf:
+                break
+            f.write(buf)
+
+
+def load_store_cache() -> Dict[str, str]:
+    """Load the content_hash -> store_name mapping from disk (empty on any error)."""
+    try:
+        with open(STORE_CACHE_PATH, "r") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            return data
+    except Exception:
+        pass
+    return {}
+
+
+def save_store_cache(cache: Dict[str, str]) -> None:
+    """Persist the content_hash -> store_name mapping; best-effort."""
+    try:
+        with open(STORE_CACHE_PATH, "w") as f:
+            json.dump(cache, f)
+    except Exception:
+        pass
+
+
+# Conversation-memory sizing: keep the last few turns verbatim and fold older
+# turns into a rolling summary so the prompt stays roughly constant-size. The
+# history itself is a bounded deque so memory and per-turn work stay constant
+# even if summarization can't keep up.
+MAX_HISTORY_TURNS = 20
+MAX_RECENT_TURNS = 6
+SUMMARIZE_EVERY = 4
+SUMMARY_MODEL = "gemini-2.5-flash-lite"
+GENERATION_MODEL = "gemini-2.5-flash-preview-09-2025"
+
+# Streamlit reruns the whole script on every widget interaction, so anything
+# fixed — compiled regexes included — belongs at module scope, built once per
+# process instead of once per rerun.
+QUESTION_SPLIT_RE = re.compile(r'(?<=\?)\s+')
+
+# Fixed prompt preamble — identical on every call, so it's a candidate for
+# Gemini context caching (see create_prompt_cache).
+PROMPT_INSTRUCTIONS = (
+    "There are 3 sections in this. A summary of the older conversation, the recent turns, "
+    "and the question currently being asked. While answering you need to check the summary "
+    "and recent turns, then answer the query in the currently asking section.\n"
+)
+
+
+def format_turns(turns: List[Dict[str, str]]) -> str:
+    """Render a list of {'question','answer'} dicts as Q:/A: lines."""
+    lines: List[str] = []
+    for item in turns:
+        q = item.get("question", "").strip()
+        a = item.get("answer", "").strip()
+        if q or a:
+            lines.append(f"Q: {q}\nA: {a}")
+    return "\n".join(lines)
+
+
+def summarize_old_turns(client, old_turns: List[Dict[str, str]], prior_summary: str) -> str:
+    """Compress older Q&A turns (plus any existing summary) into a short rolling summary.
+
+    Uses a cheap/fast model; if the call fails we return the verbatim text so no
+    context is lost (it just isn't compressed this time).
+    """
+    old_text = format_turns(old_turns)
+    summarize_prompt = (
+        "Summarize the following conversation so far into at most 200 tokens, keeping "
+        "facts, entities and any user preferences needed to answer follow-up questions.\n"
+        f"EXISTING_SUMMARY:\n{prior_summary}\n\n"
+        f"NEW_TURNS:\n{old_text}\n\n"
+        "Updated summary:"
+    )
+    try:
+        resp = client.models.generate_content(model=SUMMARY_MODEL, contents=summarize_prompt)
+        text = getattr(resp, 'text', None)
+        if text and text.strip():
+            return text.strip()
+    except Exception:
+        pass
+    # fall back to carrying the raw text forward
+    return (prior_summary + "\n" + old_text).strip()
+
+
+def rewrite_query(client, history: Deque[Dict[str, str]], question: str) -> str:
+    """Rewrite the latest question into a standalone retrieval query.
+
+    Follow-ups like "can you give an example?" retrieve poorly when sent to
+    File Search verbatim, so we resolve pronouns/references against the
+    conversation history with a cheap model first. Rewrites are cached in
+    st.session_state keyed by a digest of the formatted history + question so
+    reruns don't repeat the call; on any failure the original question is
+    used unchanged.
+    """
+    if not history:
+        return question
+    history_text = format_turns(list(history))
+    cache = st.session_state.setdefault('rewrite_cache', {})
+    # keyed on content, not history length: eviction makes the length cycle
+    # through the same values, which would serve rewrites against old context
+    key = hashlib.blake2b(f"{history_text}\n{question}".encode(), digest_size=16).hexdigest()
+    if key in cache:
+        return cache[key]
+    try:
+        resp = client.models.generate_content(
+            model=SUMMARY_MODEL,
+            contents=(
+                "Rewrite the user's latest question into a standalone search query "
+                "resolving pronouns from this history:\n"
+                f"{history_text}\n"
+                f"Question: {question}\n"
+                "Standalone query:"
+            ),
+        )
+        text = getattr(resp, 'text', None)
+        rewritten = text.strip() if text and text.strip() else question
+    except Exception:
+        rewritten = question
+    cache[key] = rewritten
+    return rewritten
+
+
+# Two-stage retrieval sizing: cast a wide net with the cheap model, then keep
+# only the best few passages for the expensive generation call.
+RETRIEVE_TOP_K = 40
+RERANK_TOP_N = 8
+
+
+def retrieve_and_rerank(client, query: str, file_search_store_name: str) -> List[str]:
+    """Retrieve up to RETRIEVE_TOP_K candidate passages, rerank, keep RERANK_TOP_N.
+
+    Stage 1 runs File Search through the cheap model and asks for verbatim
+    passages as JSON; stage 2 reranks them for the query. The winners get
+    pinned into the main prompt so the expensive generation call doesn't
+    need the retrieval tool at all. Returns [] on any failure, in which case
+    the caller falls back to single-stage tool-based retrieval.
+    """
+    try:
+        retrieval = client.models.generate_content(
+            model=SUMMARY_MODEL,
+            contents=(
+                f"Retrieve up to {RETRIEVE_TOP_K} passages from the document that are "
+                "relevant to this query and return them verbatim as JSON of the form "
+                '{"snippets": [<passage>, ...]}.\n'
+                f"Query: {query}"
+            ),
+            config=types.GenerateContentConfig(
+                response_mime_type="application/json",
+                tools=[
+                    types.Tool(
+                        file_search=types.FileSearch(
+                            file_search_store_names=[file_search_store_name]
+                        )
+                    )
+                ],
+            ),
+        )
+        snippets = json.loads(getattr(retrieval, 'text', None) or '{}').get('snippets', [])
+        snippets = [s for s in snippets if isinstance(s, str) and s.strip()]
+        if not snippets:
+            return []
+        if len(snippets) <= RERANK_TOP_N:
+            return snippets
+
+        numbered = "\n".join(f"[{i}] {s}" for i, s in enumerate(snippets))
+        rerank = client.models.generate_content(
+            model=SUMMARY_MODEL,
+            contents=(
+                "Rank the passages below by relevance to the query. Return JSON of the "
+                f'form {{"order": [<index>, ...]}} listing the {RERANK_TOP_N} most '
+                "relevant passage indices, best first.\n"
+                f"Query: {query}\n"
+                f"PASSAGES:\n{numbered}"
+            ),
+            config=types.GenerateContentConfig(response_mime_type="application/json"),
+        )
+        order = json.loads(getattr(rerank, 'text', None) or '{}').get('order', [])
+        picked = [snippets[i] for i in order[:RERANK_TOP_N]
+                  if isinstance(i, int) and 0 <= i < len(snippets)]
+        return picked or snippets[:RERANK_TOP_N]
+    except Exception:
+        return []
+
+
+def extract_response_text(resp) -> str:
+    """Normalize a generate_content response to its text, whatever the SDK shape.
+
+    Tries the known attribute spellings first, then the candidate parts, and
+    falls back to stringifying the response. Always returns a str, so callers
+    can render it and record it in the conversation history without
+    special-casing odd response shapes.
+    """
+    for attr in ("text", "output_text", "output"):
+        value = getattr(resp, attr, None)
+        if isinstance(value, str) and value:
+            return value
+    candidates = getattr(resp, "candidates", None) or []
+    if candidates:
+        try:
+            parts = candidates[0].content.parts or []
+            text = "".join(p.text for p in parts if getattr(p, "text", None))
+            if text:
+                return text
+        except Exception:
+            pass
+    return str(resp)
+
+
+def remember_response_id(response_or_chunk) -> None:
+    """Record the server-side response ID of the latest answer, if present.
+
+    The google.genai SDK exposes response_id on responses but doesn't yet
+    accept a previous_response_id on requests, so conversation state still
+    travels in the (summarized, bounded) prompt. We capture the handle anyway
+    so server-side stateful follow-ups can be wired up the moment the SDK
+    grows support — and so it's visible in the debug view meanwhile.
+    """
+    response_id = getattr(response_or_chunk, 'response_id', None)
+    if response_id:
+        st.session_state['prev_response_id'] = response_id
+
+
+def create_prompt_cache(client, file_search_store_name: str):
+    """Pre-cache the fixed prompt preamble + File Search tool config server-side.
+
+    Returns the cache name, or None when caching isn't available (e.g. the
+    preamble is below the model's minimum cacheable token count) — callers
+    fall back to sending the preamble inline.
+    """
+    try:
+        cache = client.caches.create(
+            model=GENERATION_MODEL,
+            config=types.CreateCachedContentConfig(
+                contents=[PROMPT_INSTRUCTIONS],
+                tools=[
+                    types.Tool(
+                        file_search=types.FileSearch(
+                            file_search_store_names=[file_search_store_name]
+                        )
+                    )
+                ],
+                ttl="3600s",
+            ),
+        )
+        return cache.name
+    except Exception:
+        return None
+
+
+def poll_operation_in_background(client, operation, status: Dict) -> None:
+    """Poll an import operation until done; runs on a daemon worker thread.
+
+    Same exponential backoff + jitter as before, but off the script-runner
+    thread so the page stays responsive during long imports. The worker only
+    touches the plain status dict it was handed — never st.* APIs, which are
+    not thread-safe. The main script reads the dict on each rerun.
+    """
+    delay = 1.0
+    max_delay = 30.0
+    deadline = time.monotonic() + 300
+    try:
+        while not getattr(operation, 'done', False) and time.monotonic() < deadline:
+            time.sleep(delay + random.uniform(0, 0.25 * delay))
+            delay = min(delay * 1.7, max_delay)
+            try:
+                operation = client.operations.get(operation)
+            except Exception:
+                # some SDKs surface operation differently; break to avoid infinite loop
+                break
+        status['completed'] = bool(getattr(operation, 'done', False))
+    finally:
+        status['done'] = True
+
+
+def build_prompt(client, history: Deque[Dict[str, str]], current_question: str,
+                 include_instructions: bool = True) -> str:
+    """Build the prompt with PRIOR_SUMMARY, RECENT_TURNS and CURRENTLY_ASKING sections.
+
+    history is a bounded deque of dicts with keys: 'question' and 'answer'. Only the last
+    MAX_RECENT_TURNS turns are included verbatim; older turns are summarized into
+    st.session_state['history_summary'] and dropped from the list, so the prompt
+    size stays bounded no matter how long the session runs.
+    """
+    old = list(history)[:-MAX_RECENT_TURNS] if len(history) > MAX_RECENT_TURNS else []
+    recent = list(history)[-MAX_RECENT_TURNS:]
+
+    if len(old) >= SUMMARIZE_EVERY and client is not None:
+        st.session_state['history_summary'] = summarize_old_turns(
+            client, old, st.session_state.get('history_summary', '')
+        )
+        # the summarized turns no longer need to live in session memory
+        for _ in range(len(old)):
+            history.popleft()
+        # eviction trims the deque back to MAX_RECENT_TURNS, so the length can
+        # land on a value the memo below has already seen — drop it explicitly
+        st.session_state.pop('previously_cached', None)
+
+    # Streamlit reruns this script on every widget interaction, so avoid
+    # re-joining the recent turns unless the history actually changed.
+    if st.session_state.get('prev_len') == len(history) and 'previously_cached' in st.session_state:
+        recent_text = st.session_state['previously_cached']
+    else:
+        recent_text = format_turns(recent)
+        st.session_state['previously_cached'] = recent_text
+        st.session_state['prev_len'] = len(history)
+
+    summary = st.session_state.get('history_summary', '')
+    # when the preamble is served from a server-side cache, don't resend it
+    header = PROMPT_INSTRUCTIONS if include_instructions else ""
+    prompt = (
+        f"{header}"
+        "PRIOR_SUMMARY:\n"
+        f"{summary}\n\n"
+        "RECENT_TURNS:\n"
+        f"{recent_text}\n\n"
+        "CURRENTLY_ASKING:\n"
+        f"{current_question}"
+    )
+    return prompt
+
+
+# Streamlit UI
+st.set_page_config(page_title="Gemini File Search — Streamlit", layout="centered")
+st.title("Welcome To Gemini RAG")
+
+st.markdown(
+    """
+This demo lets you upload one document (no metadata), create a File Search store,
+then ask questions. The app keeps an ephemeral per-browser-session memory of prior Q&A
+that is placed into the prompt for subsequent queries. Memory resets when the browser session ends.
+"""
+)
+
+# API key input (in the middle)
+col1, col2, col3 = st.columns([1, 2, 1])
+with col2:
+    api_key = st.text_input("Gemini API Key", type="password", help="Paste your Gemini (Google GenAI) API key here")
+
+# File uploader (max 1)
+uploaded_file = st.file_uploader(
+    "Upload ONE document (pdf, csv, json, docx, txt)",
+    type=["pdf", "csv", "json", "docx", "txt"],
+    accept_multiple_files=False,
+)
+
+# Upload button
+start_upload = st.button("Upload Data And Start Chatting", key="upload_btn")
+
+# Session state initialization
+if 'client' not in st.session_state:
+    st.session_state['client'] = None
+if 'file_search_store_name' not in st.session_state:
+    st.session_state['file_search_store_name'] = None
+if 'uploaded_filename' not in st.session_state:
+    st.session_state['uploaded_filename'] = None
+if 'file_search_ready' not in st.session_state:
+    st.session_state['file_search_ready'] = False
+if 'uploaded_hash' not in st.session_state:
+    st.session_state['uploaded_hash'] = None
+# server-side cache of the fixed prompt preamble + tool config (may stay None)
+if 'cache_name' not in st.session_state:
+    st.session_state['cache_name'] = None
+# ephemeral conversation memory: bounded deque of {'question':..., 'answer':...}
+if 'conversation_history' not in st.session_state:
+    st.session_state['conversation_history'] = collections.deque(maxlen=MAX_HISTORY_TURNS)
+# rolling summary of turns that have been evicted from conversation_history
+if 'history_summary' not in st.session_state:
+    st.session_state['history_summary'] = ""
+
+
+# When upload button is clicked
+if start_upload:
+    if not api_key:
+        st.error("Please enter your Gemini API key before uploading.")
+    elif not uploaded_file:
+        st.error("Please upload a file (max 1) to continue.")
+    else:
+        # initialize client
+        if genai is None or types is None:
+            st.error("The required GenAI library is not installed or failed to import.\nRun: pip install google-genai")
+        else:
+            # Rerun guard: Streamlit re-executes the script on every widget
+            # interaction, so a re-click (or silent rerun) with the same file
+            # should not redo disk writes or API calls.
+            current_hash = hash_uploaded_file(uploaded_file)
+            if st.session_state.get('file_search_ready') and st.session_state.get('uploaded_hash') == current_hash:
+                st.info("Already ingested — this document is ready to chat below.")
+                st.stop()
+
+            try:
+                client = client_for_key(api_key)
+                st.session_state['client'] = client
+            except Exception as e:
+                st.error(f"Failed to create GenAI client: {e}")
+                client = None
+
+            if client:
+                try:
+                    # Dedup check: if this exact content was ingested before (in
+                    # any session), reuse the existing store instead of paying
+                    # for store creation and import again.
+                    content_hash = current_hash
+                    if 'store_cache' not in st.session_state:
+                        st.session_state['store_cache'] = load_store_cache()
+                    store_cache = st.session_state['store_cache']
+
+                    cached_store_name = None
+                    if content_hash in store_cache:
+                        try:
+                            existing = client.file_search_stores.get(name=store_cache[content_hash])
+                            cached_store_name = existing.name
+                        except Exception:
+                            # stale entry (store deleted or expired) — re-import below
+                            store_cache.pop(content_hash, None)
+
+                    if cached_store_name:
+                        st.session_state['file_search_store_name'] = cached_store_name
+                        st.session_state['uploaded_filename'] = uploaded_file.name
+                        st.success("This document was ingested before — reusing the existing File Search store.")
+                        st.session_state['file_search_ready'] = True
+                        st.session_state['uploaded_hash'] = content_hash
+                        st.session_state['cache_name'] = create_prompt_cache(client, cached_store_name)
+                        # reset any prior conversation (fresh upload)
+                        st.session_state['conversation_history'] = collections.deque(maxlen=MAX_HISTORY_TURNS)
+                        st.session_state['history_summary'] = ""
+                        st.session_state['rewrite_cache'] = {}
+                    else:
+                        # Create file search store with display name set to filename stem
+                        st.info("Creating File Search store...")
+                        file_search_store = client.file_search_stores.create(
+                            config={"display_name": filename_display_name(uploaded_file.name)}
+                        )
+                        st.session_state['file_search_store_name'] = file_search_store.name
+                        st.session_state['uploaded_filename'] = uploaded_file.name
+
+                        # Spool the upload to a unique temp file so concurrent
+                        # sessions uploading same-named files can't clobber each
+                        # other; the local copy is removed after import since
+                        # the content lives server-side from then on.
+                        tf = tempfile.NamedTemporaryFile(delete=False, suffix=Path(uploaded_file.name).suffix)
+                        tmp_path = tf.name
+                        tf.close()
+                        try:
+                            write_uploaded_file(uploaded_file, tmp_path)
+
+                            st.info(f"Uploading and importing file into File Search store: {uploaded_file.name}")
+                            # NOTE: No custom_metadata is passed per user's request
+                            operation = client.file_search_stores.upload_to_file_search_store(
+                                file=str(tmp_path),
+                                file_search_store_name=file_search_store.name,
+                                config={
+                                    "display_name": filename_display_name(uploaded_file.name),
+                                },
+                            )
+
+                        finally:
+                            # the bytes are server-side once the upload call
+                            # returns; the local copy is pure overhead
+                            try:
+                                os.unlink(tmp_path)
+                            except OSError:
+                                pass
+
+                        # Poll for import completion in a background thread so
+                        # the script-runner thread (and the page) stays
+                        # responsive; the progress block below re-renders via
+                        # st.rerun until the worker flips 'done'.
+                        status = {
+                            'done': False,
+                            'completed': False,
+                            'finalized': False,
+                            'started': time.monotonic(),
+                            'store_name': file_search_store.name,
+                            'content_hash': content_hash,
+                        }
+                        st.session_state['ingest_status'] = status
+                        threading.Thread(
+                            target=poll_operation_in_background,
+                            args=(client, operation, status),
+                            daemon=True,
+                        ).start()
+
+                except Exception as e:
+                    st.exception(e)
+
+
+# Ingest progress / completion handling for the background polling thread.
+ingest_status = st.session_state.get('ingest_status')
+if ingest_status is not None and not ingest_status.get('finalized'):
+    if not ingest_status.get('done'):
+        elapsed = int(time.monotonic() - ingest_status['started'])
+        st.info(f"Importing file to Gemini File Search... elapsed {elapsed}s")
+        time.sleep(1)
+        st.rerun()
+    else:
+        ingest_status['finalized'] = True
+        # always reassign the prompt cache before marking the store ready: a
+        # leftover handle from a previous upload bakes in that document's
+        # FileSearch tool, which would silently mix documents in answers
+        st.session_state['cache_name'] = None
+        if ingest_status.get('completed'):
+            st.success("File successfully uploaded and imported. You can now ask questions about it below.")
+            # remember this content for future sessions
+            if 'store_cache' not in st.session_state:
+                st.session_state['store_cache'] = load_store_cache()
+            st.session_state['store_cache'][ingest_status['content_hash']] = ingest_status['store_name']
+            save_store_cache(st.session_state['store_cache'])
+            if api_key:
+                st.session_state['cache_name'] = create_prompt_cache(
+                    client_for_key(api_key), ingest_status['store_name']
+                )
+        else:
+            st.warning(
+                "Upload operation did not report completion within the app's wait period. The file may still be importing in the background. You can try to ask questions; the store may become available shortly."
+            )
+        st.session_state['file_search_ready'] = True
+        st.session_state['uploaded_hash'] = ingest_status['content_hash']
+        # reset any prior conversation (fresh upload)
+        st.session_state['conversation_history'] = collections.deque(maxlen=MAX_HISTORY_TURNS)
+        st.session_state['history_summary'] = ""
+        st.session_state['rewrite_cache'] = {}
+
+
+# Chat UI — only enabled after a successful upload
+st.markdown("---")
+if st.session_state.get('file_search_ready'):
+    st.subheader("Chat with your document")
+    question = st.text_area("Ask a question about the uploaded file:")
+    if st.button("Get answer"):
+        if not api_key:
+            st.error("Missing API key. Re-enter your Gemini API key above.")
+        elif not st.session_state.get('file_search_store_name'):
+            st.error("File Search store is not available. Upload again.")
+        elif not question or not question.strip():
+            st.error("Please enter a question.")
+        else:
+            client = client_for_key(api_key)
+            file_search_store_name = st.session_state['file_search_store_name']
+            try:
+                # Rewrite follow-ups into a standalone query so File Search retrieves well
+                retrieval_query = rewrite_query(client, st.session_state['conversation_history'], question)
+
+                # Build prompt including previous history (older turns are
+                # summarized); when the preamble + tool config live in a
+                # server-side cache, only the per-turn sections are sent.
+                cache_name = st.session_state.get('cache_name')
+                prompt = build_prompt(client, st.session_state['conversation_history'], question,
+                                      include_instructions=not cache_name)
+                if retrieval_query != question:
+                    prompt += f"\n\nRETRIEVAL_QUERY:\n{retrieval_query}"
+
+                if cache_name:
+                    gen_config = types.GenerateContentConfig(cached_content=cache_name)
+                else:
+                    gen_config = types.GenerateContentConfig(
+                        tools=[
+                            types.Tool(
+                                file_search=types.FileSearch(
+                                    file_search_store_names=[file_search_store_name]
+                                )
+                            )
+                        ]
+                    )
+
+                # Two-stage retrieval: pull a wide candidate set with the cheap
+                # model, rerank, and pin only the top passages into the prompt
+                # so the expensive generation call doesn't re-retrieve. Falls
+                # back to single-stage tool retrieval when it yields nothing.
+                context_snippets = retrieve_and_rerank(client, retrieval_query, file_search_store_name)
+                if context_snippets:
+                    prompt += "\n\nCONTEXT:\n" + "\n---\n".join(context_snippets)
+                    gen_config = types.GenerateContentConfig(cached_content=cache_name)
+
+                # If the user pasted several '?'-terminated questions, answer
+                # them all in one round-trip as structured JSON so the File
+                # Search latency is paid once instead of once per question.
+                questions = [q.strip() for q in QUESTION_SPLIT_RE.split(question) if q.strip()]
+                if len(questions) > 1:
+                    batch_prompt = (
+                        prompt
+                        + "\n\nThe CURRENTLY_ASKING section contains multiple questions. "
+                        + "Answer each one from the document. Return JSON of the form "
+                        + '{"answers": [{"q": <question>, "a": <answer>}, ...]} with one entry per question.'
+                    )
+                    response = client.models.generate_content(
+                        model=GENERATION_MODEL,
+                        contents=batch_prompt,
+                        config=types.GenerateContentConfig(
+                            response_mime_type="application/json",
+                            tools=gen_config.tools,
+                            cached_content=gen_config.cached_content,
+                        ),
+                    )
+                    remember_response_id(response)
+                    raw = extract_response_text(response)
+                    try:
+                        answers = json.loads(raw).get('answers', [])
+                    except Exception:
+                        answers = []
+                    if answers:
+                        st.success("Answers:")
+                        for item in answers:
+                            q_text = str(item.get('q', '')).strip()
+                            a_text = str(item.get('a', '')).strip()
+                            st.markdown(f"**{q_text}**")
+                            st.write(a_text)
+                            st.session_state['conversation_history'].append({'question': q_text, 'answer': a_text})
+                    else:
+                        # model didn't return the expected JSON — show what we got
+                        st.write(raw or response)
+                else:
+                    # Stream the answer so the user sees tokens as they arrive
+                    # rather than waiting for the full generation to finish.
+                    answer_text = None
+                    try:
+                        stream = client.models.generate_content_stream(
+                            model=GENERATION_MODEL,
+                            contents=prompt,
+                            config=gen_config,
+                        )
+                        st.success("Answer:")
+                        placeholder = st.empty()
+                        full: List[str] = []
+                        for chunk in stream:
+                            remember_response_id(chunk)
+                            text = getattr(chunk, 'text', '') or ''
+                            full.append(text)
+                            placeholder.markdown(''.join(full))
+                        answer_text = ''.join(full)
+                    except Exception:
+                        # fall back to the blocking call if streaming isn't available
+                        response = client.models.generate_content(
+                            model=GENERATION_MODEL,
+                            contents=prompt,
+                            config=gen_config,
+                        )
+
+                        remember_response_id(response)
+                        answer_text = extract_response_text(response)
+                        st.success("Answer:")
+                        st.write(answer_text)
+
+                    if answer_text:
+                        # Append Q&A to session conversation history so next prompt includes it
+                        st.session_state['conversation_history'].append({'question': question, 'answer': answer_text})
+
+            except Exception as e:
+                # a stale or expired cache handle shouldn't wedge the session;
+                # the next attempt runs stateless with the inline preamble
+                st.session_state['cache_name'] = None
+                st.exception(e)
+else:
+    st.info("Upload a file and click 'Upload Data And Start Chatting' to enable the chat interface.")
+
+
+# Small housekeeping: provide instructions and optional debug info
+st.markdown("---")
+with st.expander("How this works (technical)"):
+    st.write(
+        """
+        1. Enter your Gemini API key in the top box.
+        2. Upload a single file (pdf/csv/json/docx/txt). No metadata is requested.
+        3. Click Upload Data And Start Chatting — the app will create a File Search store and import the file.
+        4. After import, use the chat box to ask questions. The app builds a prompt containing three sections: PRIOR_SUMMARY (a rolling summary of older turns), RECENT_TURNS (the last few Q&A pairs verbatim) and CURRENTLY_ASKING (your new question). The combined prompt is sent to Gemini with the File Search tool enabled.
+        5. The conversation memory lives only in your browser session (Streamlit session_state) and resets when you close the browser tab or the session expires.
+        """
+    )
+
+# Debug view: the dict (and its JSON encoding) is only built when the checkbox
+# is on, so unchecked reruns pay nothing for it.
+if st.checkbox("Show debug session state"):
+    debug_history = list(st.session_state.get('conversation_history') or [])
+    if len(debug_history) > MAX_HISTORY_TURNS:
+        # the deque already bounds the history; this only matters if that
+        # bound ever grows or goes away, but keeps the two from drifting apart
+        debug_history = debug_history[-MAX_HISTORY_TURNS:]
+    with st.expander("State", expanded=False):
+        st.json({
+            'file_search_store_name': st.session_state.get('file_search_store_name'),
+            'uploaded_filename': st.session_state.get('uploaded_filename'),
+            'prev_response_id': st.session_state.get('prev_response_id'),
+            'conversation_history': debug_history
+        })
+
+# End of app